@@ -1,12 +1,12 @@
 import json
-import os
 from datetime import datetime
 from typing import Any, Dict, Optional
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from openai import OpenAI
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
 
 from ia_backend.services.notificaciones_service import (
@@ -14,17 +14,66 @@ from ia_backend.services.notificaciones_service import (
     consultar_notificaciones,
     detectar_eventos_financieros,
 )
+from ia_backend.services.openai_service import (
+    ConfiguracionOpenAI,
+    OpenAIServiceError,
+    solicitar_json,
+    solicitar_texto,
+)
+from ia_backend.services.profiling_service import (
+    ConfiguracionPerfilado,
+    capturar,
+    es_admin,
+    listar_capturas,
+    obtener_captura,
+    perfil_solicitado,
+)
 from ia_backend.services.reportes_service import (
+    construir_reporte_sin_modelo,
     obtener_datos_financieros,
     obtener_resumen_para_prompt,
 )
 
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
 app = FastAPI()
 
+# Se leen una sola vez: un valor OPENAI_* o PROFILING_* inválido detiene el arranque con
+# un error claro.
+config_openai = ConfiguracionOpenAI.desde_entorno()
+config_perfilado = ConfiguracionPerfilado.desde_entorno()
+
+# Perfilado opcional: ?profile=1 o X-Profile: 1 (solo admin) y muestreo de solicitudes lentas
+@app.middleware("http")
+async def perfilar_solicitudes(request: Request, call_next):
+    # Consultar las capturas no debe desplazar capturas reales del buffer.
+    if request.url.path.startswith("/perfiles"):
+        return await call_next(request)
+
+    solicitado = perfil_solicitado(request.query_params, request.headers)
+    if solicitado and not es_admin(request.headers.get("x-admin-token"), config_perfilado):
+        return JSONResponse(status_code=403, content={"detail": "Perfilado solo para administradores."})
+
+    with capturar(
+        request.method,
+        request.url.path,
+        solicitado=solicitado,
+        config=config_perfilado,
+    ) as captura:
+        response = await call_next(request)
+        if captura is not None:
+            captura.status_code = response.status_code
+
+    if solicitado and captura is not None:
+        response.headers["X-Perfil-Id"] = captura.id
+    return response
+
+
+def _verificar_admin(token: Optional[str]) -> None:
+    if not es_admin(token, config_perfilado):
+        raise HTTPException(status_code=403, detail="Perfilado solo para administradores.")
+
+
 # Permite que Flutter Web (localhost:3000) consuma la API sin errores CORS
 app.add_middleware(
     CORSMiddleware,
@@ -66,62 +115,6 @@ class DatosFinancierosRequest(BaseModel):
     metodo_pago: Optional[str] = None
 
 
-def _respuesta_openai_json(prompt: str) -> dict:
-    """Solicita a OpenAI un objeto JSON y lo convierte a dict."""
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": prompt}],
-        response_format={"type": "json_object"},
-    )
-
-    contenido = _extraer_texto_de_mensaje(completion)
-
-    try:
-        return json.loads(contenido)
-    except json.JSONDecodeError as exc:
-        raise ValueError("OpenAI no devolvió JSON válido.") from exc
-
-
-def _respuesta_openai_texto(prompt: str) -> str:
-    """Solicita a OpenAI una respuesta en texto plano."""
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": prompt}],
-    )
-
-    return _extraer_texto_de_mensaje(completion).strip()
-
-
-def _extraer_texto_de_mensaje(completion) -> str:
-    """Extrae el contenido textual del primer mensaje devuelto por Chat Completions."""
-    if not completion.choices:
-        raise ValueError("OpenAI no devolvió opciones en la respuesta.")
-
-    contenido = completion.choices[0].message.content
-
-    if isinstance(contenido, str):
-        return contenido
-
-    if isinstance(contenido, list):
-        fragmentos = []
-        for parte in contenido:
-            if isinstance(parte, str):
-                fragmentos.append(parte)
-            elif isinstance(parte, dict):
-                valor = parte.get("text")
-                if valor:
-                    fragmentos.append(valor)
-            else:
-                valor = getattr(parte, "text", None)
-                if valor:
-                    fragmentos.append(valor)
-
-        if fragmentos:
-            return "".join(fragmentos)
-
-    raise ValueError("No se pudo interpretar el contenido devuelto por OpenAI.")
-
-
 def _parse_iso_datetime(valor: Optional[Any]) -> Optional[datetime]:
     if valor is None or valor == "":
         return None
@@ -145,7 +138,8 @@ async def analizar_datos(request: AnalisisRequest):
     Datos: {request.json()}
     """
     try:
-        return _respuesta_openai_json(prompt)
+        respuesta = await run_in_threadpool(solicitar_json, prompt, config_openai)
+        return respuesta.contenido
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -199,12 +193,21 @@ async def generar_reporte(request: ReportRequest):
                 "indicando que faltan movimientos registrados."
             )
 
-        analisis = _respuesta_openai_json(prompt)
+        # Si OpenAI no responde a tiempo se devuelve un reporte determinista.
+        # La llamada (reintentos, backoff, cobertura) corre fuera del event loop.
+        try:
+            respuesta = await run_in_threadpool(solicitar_json, prompt, config_openai)
+            analisis = respuesta.contenido
+            origen = respuesta.modelo
+        except OpenAIServiceError:
+            analisis = construir_reporte_sin_modelo(request.tipo, resumen_prompt)
+            origen = "determinista"
 
         return {
             "filtros": parametros,
             "datos_financieros": datos_financieros,
             "reporte_modelo": analisis,
+            "origen_reporte": origen,
         }
     except ValueError as err:
         raise HTTPException(status_code=400, detail=str(err))
@@ -247,7 +250,8 @@ async def generar_notificaciones_automaticas(request: AnalisisRequest, user_id:
 async def endpoint_crear_notificacion(request: NotificationRequest):
     prompt = f"Genera una notificación para el usuario {request.user_id} sobre el evento {request.evento} con datos: {request.datos}"
     try:
-        mensaje = _respuesta_openai_texto(prompt)
+        respuesta = await run_in_threadpool(solicitar_texto, prompt, config_openai)
+        mensaje = respuesta.contenido
         notificacion = crear_notificacion(
             user_id=request.user_id,
             tipo=request.evento,
@@ -268,3 +272,33 @@ async def endpoint_consultar_notificaciones(user_id: str):
         return {"notificaciones": notificaciones}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+# Capturas de perfilado (solicitadas o lentas), solo para administradores
+@app.get("/perfiles")
+async def endpoint_listar_perfiles(x_admin_token: Optional[str] = Header(None)):
+    _verificar_admin(x_admin_token)
+    return {"perfiles": listar_capturas()}
+
+
+@app.get("/perfiles/{perfil_id}")
+async def endpoint_detalle_perfil(perfil_id: str, x_admin_token: Optional[str] = Header(None)):
+    _verificar_admin(x_admin_token)
+    captura = obtener_captura(perfil_id)
+    if captura is None:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado.")
+    return captura.detalle()
+
+
+@app.get("/perfiles/{perfil_id}/descarga")
+async def endpoint_descargar_perfil(perfil_id: str, x_admin_token: Optional[str] = Header(None)):
+    _verificar_admin(x_admin_token)
+    captura = obtener_captura(perfil_id)
+    if captura is None or captura.contenido is None:
+        raise HTTPException(status_code=404, detail="Perfil sin contenido descargable.")
+    media_type = "text/html" if captura.motor == "pyinstrument" else "application/octet-stream"
+    return Response(
+        content=captura.contenido,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{captura.nombre_archivo}"'},
+    )
@@ -0,0 +1,441 @@
+"""Capa de llamadas a OpenAI con plazos, reintentos, cobertura y modelo de respaldo."""
+
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from functools import lru_cache, partial
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    InternalServerError,
+    OpenAI,
+    RateLimitError,
+)
+
+from ia_backend.services.profiling_service import medir
+
+load_dotenv()
+
+
+class OpenAIServiceError(RuntimeError):
+    """Señala que ningún modelo respondió correctamente dentro del plazo."""
+
+
+class OpenAIConfigError(RuntimeError):
+    """Señala una configuración inválida para la capa de OpenAI."""
+
+
+class _TiempoAgotado(Exception):
+    """Ninguna solicitud (principal o de cobertura) terminó dentro del plazo."""
+
+
+_ERRORES_REINTENTABLES = (
+    APIConnectionError,
+    APITimeoutError,
+    InternalServerError,
+    RateLimitError,
+    ValueError,
+    _TiempoAgotado,
+)
+
+_MUESTRAS_MINIMAS_P95 = 20
+# La cobertura sale, como tarde, a esta fracción del timeout del intento.
+_FRACCION_MAX_COBERTURA = 0.5
+_MAX_MUESTRAS = 200
+# Latencias por (modelo, tipo de respuesta): el p95 de un modelo no contamina al otro.
+_latencias: Dict[Tuple[str, str], Deque[float]] = {}
+_latencias_lock = threading.Lock()
+_MAX_COBERTURAS = 8
+_executor = ThreadPoolExecutor(max_workers=_MAX_COBERTURAS, thread_name_prefix="openai-cobertura")
+# Un cupo por hilo del executor: si no queda ninguno la cobertura se omite, nunca se encola.
+_cupos_cobertura = threading.BoundedSemaphore(_MAX_COBERTURAS)
+
+
+@dataclass(frozen=True)
+class ConfiguracionOpenAI:
+    modelo: str
+    modelo_respaldo: Optional[str]
+    timeout_segundos: float
+    plazo_total_segundos: float
+    reintentos: int
+    backoff_segundos: float
+    cobertura_segundos: Optional[float]
+
+    @classmethod
+    def desde_entorno(cls) -> "ConfiguracionOpenAI":
+        """Lee la configuración; se llama una vez al arrancar la API."""
+        timeout = _leer_float("OPENAI_TIMEOUT_SEGUNDOS", 15.0)
+        if timeout <= 0:
+            raise OpenAIConfigError("OPENAI_TIMEOUT_SEGUNDOS debe ser mayor que 0.")
+        plazo_total = _leer_float("OPENAI_PLAZO_TOTAL_SEGUNDOS", 40.0)
+        if plazo_total <= 0:
+            raise OpenAIConfigError("OPENAI_PLAZO_TOTAL_SEGUNDOS debe ser mayor que 0.")
+        reintentos = _leer_int("OPENAI_REINTENTOS", 1)
+        if reintentos < 0:
+            raise OpenAIConfigError("OPENAI_REINTENTOS no puede ser negativo.")
+        backoff = _leer_float("OPENAI_BACKOFF_SEGUNDOS", 0.5)
+        if backoff < 0:
+            raise OpenAIConfigError("OPENAI_BACKOFF_SEGUNDOS no puede ser negativo.")
+        cobertura = _leer_float("OPENAI_HEDGE_SEGUNDOS", 0.0)
+
+        return cls(
+            modelo=os.getenv("OPENAI_MODEL") or "gpt-4o",
+            modelo_respaldo=os.getenv("OPENAI_FALLBACK_MODEL", "gpt-4o-mini") or None,
+            timeout_segundos=timeout,
+            plazo_total_segundos=plazo_total,
+            reintentos=reintentos,
+            backoff_segundos=backoff,
+            cobertura_segundos=cobertura if cobertura > 0 else None,
+        )
+
+
+@dataclass(frozen=True)
+class RespuestaModelo:
+    contenido: Any
+    modelo: str
+
+
+@lru_cache(maxsize=1)
+def get_openai_client() -> OpenAI:
+    # Los reintentos los gestiona esta capa para poder respetar el plazo total.
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+
+
+def solicitar_json(
+    prompt: str,
+    config: ConfiguracionOpenAI,
+) -> RespuestaModelo:
+    """Solicita a OpenAI un objeto JSON y lo convierte a dict."""
+    return _solicitar(
+        prompt,
+        tipo="json",
+        procesar=_parsear_json,
+        extra={"response_format": {"type": "json_object"}},
+        config=config,
+    )
+
+
+def solicitar_texto(
+    prompt: str,
+    config: ConfiguracionOpenAI,
+) -> RespuestaModelo:
+    """Solicita a OpenAI una respuesta en texto plano."""
+    return _solicitar(
+        prompt,
+        tipo="texto",
+        procesar=lambda contenido: contenido.strip(),
+        extra={},
+        config=config,
+    )
+
+
+def _solicitar(
+    prompt: str,
+    *,
+    tipo: str,
+    procesar: Callable[[str], Any],
+    extra: Dict[str, Any],
+    config: ConfiguracionOpenAI,
+) -> RespuestaModelo:
+    """Recorre el modelo principal y el de respaldo con reintentos y backoff.
+
+    Cada intento respeta ``timeout_segundos`` y el conjunto de intentos no excede
+    ``plazo_total_segundos``. Si hay modelo de respaldo, el principal deja libre un
+    ``timeout_segundos`` (como mucho la mitad del plazo) para que el respaldo siempre
+    tenga un intento. Los errores 4xx distintos de 429 no se reintentan con el mismo
+    modelo, pero sí se prueba el modelo de respaldo.
+    """
+
+    limite = time.monotonic() + config.plazo_total_segundos
+    modelos = [(config.modelo, limite)]
+    if config.modelo_respaldo and config.modelo_respaldo != config.modelo:
+        reserva = min(config.timeout_segundos, config.plazo_total_segundos / 2)
+        modelos = [(config.modelo, limite - reserva), (config.modelo_respaldo, limite)]
+
+    errores: List[str] = []
+    for modelo, limite_modelo in modelos:
+        for intento in range(config.reintentos + 1):
+            restante = limite_modelo - time.monotonic()
+            if restante <= 0:
+                break
+
+            try:
+                with medir("openai.solicitud", modelo=modelo, intento=intento):
+                    contenido = _llamar_con_cobertura(
+                        modelo,
+                        prompt,
+                        tipo=tipo,
+                        procesar=procesar,
+                        extra=extra,
+                        timeout=min(config.timeout_segundos, restante),
+                        timeout_configurado=config.timeout_segundos,
+                        cobertura=config.cobertura_segundos,
+                    )
+                return RespuestaModelo(contenido=contenido, modelo=modelo)
+            except _ERRORES_REINTENTABLES as exc:
+                errores.append(f"{modelo}: {_describir_error(exc)}")
+            except APIStatusError as exc:
+                errores.append(f"{modelo}: {_describir_error(exc)}")
+                break
+
+            if intento < config.reintentos:
+                espera = config.backoff_segundos * (2 ** intento)
+                espera += random.uniform(0, config.backoff_segundos)
+                time.sleep(max(0.0, min(espera, limite_modelo - time.monotonic())))
+
+    raise OpenAIServiceError(
+        "OpenAI no respondió correctamente: " + "; ".join(errores or ["plazo agotado"]),
+    )
+
+
+def _llamar_con_cobertura(
+    modelo: str,
+    prompt: str,
+    *,
+    tipo: str,
+    procesar: Callable[[str], Any],
+    extra: Dict[str, Any],
+    timeout: float,
+    timeout_configurado: float,
+    cobertura: Optional[float],
+) -> Any:
+    """Lanza la solicitud y, si tarda más que el retardo de cobertura, envía una segunda.
+
+    El intento principal corre en un hilo propio, así que nunca espera en la cola del
+    executor; la cobertura solo se envía si el executor tiene un hilo libre. Se conserva
+    la primera respuesta válida y, al terminar, se cancela lo que siga pendiente.
+
+    El ``timeout`` del SDK se aplica por fase (conexión, lectura...), no al total: una
+    respuesta que llega poco a poco puede superarlo. Por eso el hilo que llama espera
+    a los futures con ``timeout`` de reloj, también sin cobertura. Una solicitud ya en
+    curso no puede cancelarse; se abandona y termina por su cuenta.
+
+    Los timeouts se registran con ``timeout_configurado`` y no con el timeout recortado
+    del intento (cobertura o final del plazo), para no sesgar el p95 hacia abajo. El
+    retardo se limita a una fracción del timeout del intento: aunque el p95 alcance el
+    timeout, la cobertura sigue enviándose justo cuando más hace falta.
+    """
+
+    retardo = _retardo_cobertura(modelo, tipo, cobertura)
+    if retardo is not None:
+        retardo = min(retardo, timeout * _FRACCION_MAX_COBERTURA)
+    llamada = partial(_llamar, modelo, prompt, procesar=procesar, extra=extra)
+    inicio = time.monotonic()
+    principal = _Muestra(modelo, tipo, timeout_configurado)
+    futuro_principal = _en_hilo(llamada, timeout=timeout, muestra=principal)
+    muestras: Dict[Future, _Muestra] = {futuro_principal: principal}
+    pendientes: List[Future] = [futuro_principal]
+    try:
+        if retardo is not None:
+            terminadas, _ = wait(pendientes, timeout=retardo)
+            if not terminadas:
+                muestra = _Muestra(modelo, tipo, timeout_configurado)
+                futuro_cobertura = _lanzar_cobertura(
+                    llamada,
+                    timeout=timeout - retardo,
+                    muestra=muestra,
+                )
+                if futuro_cobertura is not None:
+                    muestras[futuro_cobertura] = muestra
+                    pendientes.append(futuro_cobertura)
+
+        ultimo_error: Optional[BaseException] = None
+        while pendientes:
+            restante = timeout - (time.monotonic() - inicio)
+            terminadas, _ = wait(
+                pendientes,
+                timeout=max(0.0, restante),
+                return_when=FIRST_COMPLETED,
+            )
+            if not terminadas:
+                for futuro in pendientes:
+                    muestras[futuro].registrar_timeout()
+                raise _TiempoAgotado(f"sin respuesta en {timeout:.1f}s")
+            for futuro in terminadas:
+                pendientes.remove(futuro)
+                error = futuro.exception()
+                if error is None:
+                    return futuro.result()
+                ultimo_error = error
+
+        assert ultimo_error is not None
+        raise ultimo_error
+    finally:
+        for futuro in pendientes:
+            futuro.cancel()
+
+
+def _en_hilo(funcion: Callable[..., Any], **kwargs: Any) -> Future:
+    """Ejecuta ``funcion`` en un hilo propio y devuelve un ``Future`` con su resultado."""
+    futuro: Future = Future()
+    futuro.set_running_or_notify_cancel()
+
+    def ejecutar() -> None:
+        try:
+            futuro.set_result(funcion(**kwargs))
+        except BaseException as exc:  # noqa: BLE001 - se entrega al Future
+            futuro.set_exception(exc)
+
+    threading.Thread(target=ejecutar, name="openai-principal", daemon=True).start()
+    return futuro
+
+
+def _lanzar_cobertura(funcion: Callable[..., Any], **kwargs: Any) -> Optional[Future]:
+    """Envía la cobertura al executor si hay un hilo libre; si no, devuelve ``None``."""
+    if not _cupos_cobertura.acquire(blocking=False):
+        return None
+    futuro = _executor.submit(funcion, **kwargs)
+    futuro.add_done_callback(lambda _: _cupos_cobertura.release())
+    return futuro
+
+
+class _Muestra:
+    """Latencia de un intento; se registra una sola vez, la primera que se conoce.
+
+    Se registran las respuestas (también las que no se pueden interpretar) y los
+    timeouts, estos últimos con el valor del timeout, para que el p95 no quede sesgado
+    hacia las llamadas rápidas. Si el hilo que espera abandona el intento por tiempo,
+    registra el timeout; lo que el intento termine después ya no cuenta.
+    """
+
+    def __init__(self, modelo: str, tipo: str, timeout: float) -> None:
+        self._clave = (modelo, tipo)
+        self._timeout = timeout
+        self._registrada = False
+        self._lock = threading.Lock()
+
+    def registrar(self, segundos: float) -> None:
+        with self._lock:
+            if self._registrada:
+                return
+            self._registrada = True
+        _registrar_latencia(*self._clave, segundos)
+
+    def registrar_timeout(self) -> None:
+        self.registrar(self._timeout)
+
+
+def _llamar(
+    modelo: str,
+    prompt: str,
+    *,
+    procesar: Callable[[str], Any],
+    extra: Dict[str, Any],
+    timeout: float,
+    muestra: _Muestra,
+) -> Any:
+    """Hace una solicitud y registra su latencia.
+
+    Los errores de conexión o de estado no miden latencia del modelo y se omiten.
+    """
+
+    inicio = time.monotonic()
+    try:
+        completion = get_openai_client().chat.completions.create(
+            model=modelo,
+            messages=[{"role": "user", "content": prompt}],
+            timeout=timeout,
+            **extra,
+        )
+    except APITimeoutError:
+        muestra.registrar_timeout()
+        raise
+
+    muestra.registrar(time.monotonic() - inicio)
+    return procesar(_extraer_texto_de_mensaje(completion))
+
+
+def _retardo_cobertura(modelo: str, tipo: str, cobertura: Optional[float]) -> Optional[float]:
+    """Usa el p95 de las latencias observadas o el valor configurado si aún hay pocas."""
+    if cobertura is None:
+        return None
+    with _latencias_lock:
+        muestras = sorted(_latencias.get((modelo, tipo), ()))
+    if len(muestras) < _MUESTRAS_MINIMAS_P95:
+        return cobertura
+    return muestras[int(0.95 * (len(muestras) - 1))]
+
+
+def _registrar_latencia(modelo: str, tipo: str, segundos: float) -> None:
+    with _latencias_lock:
+        _latencias.setdefault((modelo, tipo), deque(maxlen=_MAX_MUESTRAS)).append(segundos)
+
+
+def limpiar_latencias() -> None:
+    """Descarta las latencias observadas (útil al cambiar de modelo o en pruebas)."""
+    with _latencias_lock:
+        _latencias.clear()
+
+
+def _parsear_json(contenido: str) -> Dict[str, Any]:
+    try:
+        return json.loads(contenido)
+    except json.JSONDecodeError as exc:
+        raise ValueError("OpenAI no devolvió JSON válido.") from exc
+
+
+def _extraer_texto_de_mensaje(completion) -> str:
+    """Extrae el contenido textual del primer mensaje devuelto por Chat Completions."""
+    if not completion.choices:
+        raise ValueError("OpenAI no devolvió opciones en la respuesta.")
+
+    contenido = completion.choices[0].message.content
+
+    if isinstance(contenido, str):
+        return contenido
+
+    if isinstance(contenido, list):
+        fragmentos = []
+        for parte in contenido:
+            if isinstance(parte, str):
+                fragmentos.append(parte)
+            elif isinstance(parte, dict):
+                valor = parte.get("text")
+                if valor:
+                    fragmentos.append(valor)
+            else:
+                valor = getattr(parte, "text", None)
+                if valor:
+                    fragmentos.append(valor)
+
+        if fragmentos:
+            return "".join(fragmentos)
+
+    raise ValueError("No se pudo interpretar el contenido devuelto por OpenAI.")
+
+
+def _describir_error(exc: BaseException) -> str:
+    status = getattr(exc, "status_code", None)
+    nombre = type(exc).__name__
+    return f"{nombre} ({status})" if status else f"{nombre}: {exc}"
+
+
+def _leer_float(nombre: str, defecto: float) -> float:
+    valor = os.getenv(nombre)
+    if valor is None or valor.strip() == "":
+        return defecto
+    try:
+        return float(valor)
+    except ValueError as exc:
+        raise OpenAIConfigError(f"{nombre} debe ser numérico: {valor}") from exc
+
+
+def _leer_int(nombre: str, defecto: int) -> int:
+    valor = os.getenv(nombre)
+    if valor is None or valor.strip() == "":
+        return defecto
+    try:
+        return int(valor)
+    except ValueError as exc:
+        raise OpenAIConfigError(f"{nombre} debe ser un número entero: {valor}") from exc
@@ -0,0 +1,268 @@
+"""Perfilado opcional de solicitudes y muestreo de solicitudes lentas.
+
+Dos mecanismos complementarios:
+
+* ``medir(nombre)`` registra tramos con su duración (consultas a Supabase, agregación,
+  llamadas a OpenAI). Es barato y se activa para toda solicitud cuando hay umbral.
+* Un perfilador completo (cProfile, o pyinstrument si está instalado y se elige con
+  ``PROFILING_MOTOR``) se ejecuta cuando un administrador lo pide con ``?profile=1`` o
+  la cabecera ``X-Profile: 1``, o para una fracción ``PROFILING_TASA_MUESTREO`` de las
+  solicitudes.
+
+Las capturas solicitadas, las muestreadas y las que superan ``PROFILING_UMBRAL_MS`` se
+guardan en un buffer circular de ``PROFILING_MAX_CAPTURAS`` elementos.
+"""
+
+from __future__ import annotations
+
+import cProfile
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+import hmac
+import io
+import marshal
+import os
+import pstats
+import random
+import threading
+import time
+from typing import Any, Deque, Dict, Iterator, List, Mapping, Optional
+import uuid
+
+from dotenv import load_dotenv
+
+try:
+    from pyinstrument import Profiler as PyinstrumentProfiler
+except ImportError:  # pragma: no cover - dependencia opcional
+    PyinstrumentProfiler = None
+
+load_dotenv()
+
+
+_VALORES_ACTIVOS = {"1", "true", "si", "sí", "yes"}
+_LINEAS_RESUMEN = 40
+
+_captura_actual: ContextVar[Optional["CapturaPerfil"]] = ContextVar(
+    "captura_perfil_actual",
+    default=None,
+)
+# cProfile instala un hook por hilo: solo una captura completa a la vez.
+_perfilador_lock = threading.Lock()
+_buffer_lock = threading.Lock()
+_capturas: Deque["CapturaPerfil"] = deque(maxlen=50)
+
+
+class ProfilingConfigError(RuntimeError):
+    """Señala una configuración inválida para el perfilado."""
+
+
+@dataclass(frozen=True)
+class ConfiguracionPerfilado:
+    token_admin: Optional[str]
+    umbral_ms: Optional[float]
+    tasa_muestreo: float
+    max_capturas: int
+    motor: str
+
+    @classmethod
+    def desde_entorno(cls) -> "ConfiguracionPerfilado":
+        """Lee la configuración; se llama una vez al arrancar la API."""
+        tasa_muestreo = _leer_numero("PROFILING_TASA_MUESTREO", float, 0.0)
+        if not 0.0 <= tasa_muestreo <= 1.0:
+            raise ProfilingConfigError("PROFILING_TASA_MUESTREO debe estar entre 0 y 1.")
+        max_capturas = _leer_numero("PROFILING_MAX_CAPTURAS", int, 50)
+        if max_capturas < 1:
+            raise ProfilingConfigError("PROFILING_MAX_CAPTURAS debe ser al menos 1.")
+
+        return cls(
+            token_admin=os.getenv("PROFILING_ADMIN_TOKEN") or None,
+            umbral_ms=_leer_numero("PROFILING_UMBRAL_MS", float, None),
+            tasa_muestreo=tasa_muestreo,
+            max_capturas=max_capturas,
+            motor=(os.getenv("PROFILING_MOTOR") or "cprofile").lower(),
+        )
+
+
+@dataclass
+class CapturaPerfil:
+    metodo: str
+    ruta: str
+    motivo: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    fecha: str = field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    duracion_ms: Optional[float] = None
+    status_code: Optional[int] = None
+    tramos: List[Dict[str, Any]] = field(default_factory=list)
+    motor: Optional[str] = None
+    resumen: Optional[str] = None
+    contenido: Optional[bytes] = None
+
+    def metadatos(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "fecha": self.fecha,
+            "metodo": self.metodo,
+            "ruta": self.ruta,
+            "motivo": self.motivo,
+            "duracion_ms": self.duracion_ms,
+            "status_code": self.status_code,
+            "motor": self.motor,
+            "descargable": self.contenido is not None,
+        }
+
+    def detalle(self) -> Dict[str, Any]:
+        return {**self.metadatos(), "tramos": self.tramos, "resumen": self.resumen}
+
+    @property
+    def nombre_archivo(self) -> str:
+        extension = "html" if self.motor == "pyinstrument" else "prof"
+        return f"perfil-{self.id}.{extension}"
+
+
+def es_admin(token: Optional[str], config: ConfiguracionPerfilado) -> bool:
+    """Compara el token recibido con ``PROFILING_ADMIN_TOKEN`` en tiempo constante."""
+    if not config.token_admin or not token:
+        return False
+    return hmac.compare_digest(token.encode(), config.token_admin.encode())
+
+
+def perfil_solicitado(
+    query_params: Mapping[str, str],
+    headers: Mapping[str, str],
+) -> bool:
+    valor = query_params.get("profile") or headers.get("x-profile") or ""
+    return valor.strip().lower() in _VALORES_ACTIVOS
+
+
+@contextmanager
+def medir(nombre: str, **datos: Any) -> Iterator[None]:
+    """Registra la duración de un tramo en la captura activa, si la hay."""
+    captura = _captura_actual.get()
+    if captura is None:
+        yield
+        return
+
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        captura.tramos.append(
+            {
+                "nombre": nombre,
+                "duracion_ms": round((time.perf_counter() - inicio) * 1000, 3),
+                **datos,
+            },
+        )
+
+
+@contextmanager
+def capturar(
+    metodo: str,
+    ruta: str,
+    *,
+    solicitado: bool,
+    config: ConfiguracionPerfilado,
+) -> Iterator[Optional[CapturaPerfil]]:
+    """Envuelve una solicitud y guarda la captura si fue pedida, muestreada o lenta.
+
+    Devuelve ``None`` cuando el perfilado está desactivado para la solicitud.
+    """
+
+    muestreada = config.tasa_muestreo > 0 and random.random() < config.tasa_muestreo
+    if not solicitado and config.umbral_ms is None and not muestreada:
+        yield None
+        return
+
+    if solicitado:
+        motivo = "solicitado"
+    elif muestreada:
+        motivo = "muestreo"
+    else:
+        motivo = "lento"
+    captura = CapturaPerfil(metodo=metodo, ruta=ruta, motivo=motivo)
+    perfilador = None
+    if (solicitado or muestreada) and _perfilador_lock.acquire(blocking=False):
+        perfilador = _iniciar_perfilador(config.motor)
+        captura.motor = "pyinstrument" if _es_pyinstrument(perfilador) else "cprofile"
+
+    token = _captura_actual.set(captura)
+    inicio = time.perf_counter()
+    try:
+        yield captura
+    finally:
+        captura.duracion_ms = round((time.perf_counter() - inicio) * 1000, 3)
+        _captura_actual.reset(token)
+        if perfilador is not None:
+            try:
+                _detener_perfilador(perfilador, captura)
+            finally:
+                _perfilador_lock.release()
+
+        lenta = config.umbral_ms is not None and captura.duracion_ms >= config.umbral_ms
+        if solicitado or muestreada or lenta:
+            _guardar(captura, config.max_capturas)
+
+
+def listar_capturas() -> List[Dict[str, Any]]:
+    with _buffer_lock:
+        return [captura.metadatos() for captura in reversed(_capturas)]
+
+
+def obtener_captura(captura_id: str) -> Optional[CapturaPerfil]:
+    with _buffer_lock:
+        for captura in _capturas:
+            if captura.id == captura_id:
+                return captura
+    return None
+
+
+def _guardar(captura: CapturaPerfil, max_capturas: int) -> None:
+    global _capturas
+    with _buffer_lock:
+        if _capturas.maxlen != max_capturas:
+            _capturas = deque(_capturas, maxlen=max_capturas)
+        _capturas.append(captura)
+
+
+def _iniciar_perfilador(motor: str):
+    if motor == "pyinstrument" and PyinstrumentProfiler is not None:
+        perfilador = PyinstrumentProfiler(async_mode="enabled")
+        perfilador.start()
+        return perfilador
+
+    perfilador = cProfile.Profile()
+    perfilador.enable()
+    return perfilador
+
+
+def _detener_perfilador(perfilador, captura: CapturaPerfil) -> None:
+    if _es_pyinstrument(perfilador):
+        perfilador.stop()
+        captura.resumen = perfilador.output_text(unicode=True)
+        captura.contenido = perfilador.output_html().encode("utf-8")
+        return
+
+    perfilador.disable()
+    salida = io.StringIO()
+    estadisticas = pstats.Stats(perfilador, stream=salida)
+    estadisticas.sort_stats("cumulative").print_stats(_LINEAS_RESUMEN)
+    captura.resumen = salida.getvalue()
+    # Mismo formato que ``dump_stats``: se abre con pstats, snakeviz, etc.
+    captura.contenido = marshal.dumps(estadisticas.stats)
+
+
+def _leer_numero(nombre: str, tipo, defecto):
+    valor = os.getenv(nombre)
+    if valor is None or valor.strip() == "":
+        return defecto
+    try:
+        return tipo(valor)
+    except ValueError as exc:
+        raise ProfilingConfigError(f"{nombre} debe ser numérico: {valor}") from exc
+
+
+def _es_pyinstrument(perfilador) -> bool:
+    return PyinstrumentProfiler is not None and isinstance(perfilador, PyinstrumentProfiler)
@@ -8,6 +8,7 @@ from decimal import Decimal
 import re
 from typing import Any, Dict, Iterable, List, Optional
 
+from ia_backend.services.profiling_service import medir
 from ia_backend.services.supabase_client import get_supabase_client
 
 supabase = get_supabase_client()
@@ -39,14 +40,15 @@ def _resolver_categoria_id(
 
     termino = categoria_id.strip()
 
-    respuesta = (
-        supabase.table(tabla)
-        .select("id, nombre")
-        .eq("usuario_id", user_id)
-        .ilike("nombre", f"%{termino}%")
-        .limit(1)
-        .execute()
-    )
+    with medir("supabase.resolver_categoria", tabla=tabla):
+        respuesta = (
+            supabase.table(tabla)
+            .select("id, nombre")
+            .eq("usuario_id", user_id)
+            .ilike("nombre", f"%{termino}%")
+            .limit(1)
+            .execute()
+        )
 
     registros = respuesta.data or []
     if not registros:
@@ -87,6 +89,24 @@ def obtener_datos_financieros(
         limite=limite,
     )
 
+    with medir("agregacion", gastos=len(gastos), ingresos=len(ingresos)):
+        return _agregar_datos_financieros(
+            user_id,
+            fecha_inicio=fecha_inicio,
+            fecha_fin=fecha_fin,
+            gastos=gastos,
+            ingresos=ingresos,
+        )
+
+
+def _agregar_datos_financieros(
+    user_id: str,
+    *,
+    fecha_inicio: Optional[datetime],
+    fecha_fin: Optional[datetime],
+    gastos: List[Dict[str, Any]],
+    ingresos: List[Dict[str, Any]],
+) -> Dict[str, Any]:
     total_gastos = _sumar_montos(gastos)
     total_ingresos = _sumar_montos(ingresos)
     balance = round(total_ingresos - total_gastos, 2)
@@ -152,7 +172,8 @@ def _consultar_gastos(
     if metodo_pago:
         query = query.eq("tipo", _normalizar_metodo_pago(metodo_pago))
 
-    response = query.execute()
+    with medir("supabase.consulta", tabla="gastos"):
+        response = query.execute()
     datos = response.data or []
     return [_normalizar_registro(item) for item in datos]
 
@@ -188,7 +209,8 @@ def _consultar_ingresos(
     if categoria_filtrada:
         query = query.eq("categoria_id", categoria_filtrada)
 
-    response = query.execute()
+    with medir("supabase.consulta", tabla="ingresos"):
+        response = query.execute()
     datos = response.data or []
     return [_normalizar_registro(item) for item in datos]
 
@@ -291,3 +313,71 @@ def obtener_resumen_para_prompt(datos: Dict[str, Any]) -> Dict[str, Any]:
         "top_categorias_ingreso": ingresos.get("por_categoria", [])[:5],
         "distribucion_tipo_gasto": gastos.get("por_tipo_gasto", []),
     }
+
+
+def construir_reporte_sin_modelo(
+    tipo: str,
+    resumen: Optional[Dict[str, Any]],
+) -> Dict[str, Any]:
+    """Genera un reporte determinista a partir de ``obtener_resumen_para_prompt``.
+
+    Se usa cuando OpenAI no responde a tiempo; conserva las claves ``resumen``,
+    ``alertas`` y ``recomendaciones`` que espera la app.
+    """
+
+    if not resumen:
+        return {
+            "resumen": (
+                f"Reporte {tipo}: no se encontraron movimientos registrados para los "
+                "filtros seleccionados."
+            ),
+            "alertas": [],
+            "recomendaciones": [
+                "Registra tus ingresos y gastos para obtener un análisis detallado.",
+            ],
+        }
+
+    totales = resumen.get("totales", {})
+    ingresos = totales.get("ingresos", 0.0)
+    gastos = totales.get("gastos", 0.0)
+    balance = totales.get("balance", 0.0)
+    ratio = totales.get("ratio_gastos_sobre_ingresos")
+
+    alertas: List[str] = []
+    recomendaciones: List[str] = []
+
+    if balance < 0:
+        alertas.append(f"Tus gastos superan a tus ingresos en {abs(balance):.2f}.")
+        recomendaciones.append("Reduce gastos variables hasta recuperar un balance positivo.")
+    if ratio is not None and ratio >= 0.9:
+        alertas.append(f"Los gastos representan el {ratio * 100:.1f}% de tus ingresos.")
+        recomendaciones.append("Intenta mantener los gastos por debajo del 80% de tus ingresos.")
+    elif ratio is not None and ratio < 0.8:
+        recomendaciones.append("Destina parte del excedente a tu fondo de ahorro.")
+
+    top_gasto = resumen.get("top_categorias_gasto") or []
+    if top_gasto and gastos > 0:
+        principal = top_gasto[0]
+        participacion = principal.get("total", 0.0) / gastos
+        if participacion >= 0.4:
+            alertas.append(
+                f"La categoría {principal.get('valor')} concentra el "
+                f"{participacion * 100:.1f}% de tus gastos.",
+            )
+            recomendaciones.append(
+                f"Revisa los gastos de la categoría {principal.get('valor')}.",
+            )
+
+    if not recomendaciones:
+        recomendaciones.append("Mantén el seguimiento periódico de tus movimientos.")
+
+    return {
+        "resumen": (
+            f"Reporte {tipo}: ingresos {ingresos:.2f}, gastos {gastos:.2f}, "
+            f"balance {balance:.2f}."
+        ),
+        "alertas": alertas,
+        "recomendaciones": recomendaciones,
+        "top_categorias_gasto": top_gasto,
+        "top_categorias_ingreso": resumen.get("top_categorias_ingreso") or [],
+    }
@@ -0,0 +1,148 @@
+"""Servidor local que imita ``/v1/chat/completions`` para probar la capa de OpenAI.
+
+Permite inyectar latencia y errores por modelo enviando un JSON a ``POST /_control``:
+
+    {
+      "gpt-4o": {"latencias": [3.0, 0.1], "errores": [500], "json_invalido": false},
+      "gpt-4o-mini": {"latencias": [0.05]}
+    }
+
+``latencias`` y ``errores`` se consumen en orden, una entrada por solicitud; la última
+latencia se repite y, al agotarse los errores, el modelo responde con éxito.
+``goteo`` (segundos) envía el cuerpo de la respuesta byte a byte repartido en ese
+tiempo, para simular una respuesta que nunca agota el timeout de lectura.
+
+Uso: python -m ia_backend.utils.fake_openai_server --port 8765
+y luego OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, direccion):
+        super().__init__(direccion, _Handler)
+        self.lock = threading.Lock()
+        self.escenarios: Dict[str, Dict[str, Any]] = {}
+        self.solicitudes: List[str] = []
+
+    def configurar(self, escenarios: Dict[str, Dict[str, Any]]) -> None:
+        with self.lock:
+            self.escenarios = {
+                modelo: {
+                    "latencias": list(conf.get("latencias") or [0.0]),
+                    "errores": list(conf.get("errores") or []),
+                    "json_invalido": bool(conf.get("json_invalido")),
+                    "goteo": float(conf.get("goteo") or 0.0),
+                }
+                for modelo, conf in escenarios.items()
+            }
+            self.solicitudes = []
+
+    def _siguiente_paso(self, modelo: str):
+        with self.lock:
+            self.solicitudes.append(modelo)
+            escenario = self.escenarios.get(modelo, {"latencias": [0.0], "errores": []})
+            latencias = escenario["latencias"]
+            latencia = latencias.pop(0) if len(latencias) > 1 else latencias[0]
+            error = escenario["errores"].pop(0) if escenario["errores"] else None
+            return (
+                latencia,
+                error,
+                escenario.get("json_invalido", False),
+                escenario.get("goteo", 0.0),
+            )
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def iniciar_en_segundo_plano(self) -> threading.Thread:
+        hilo = threading.Thread(target=self.serve_forever, daemon=True)
+        hilo.start()
+        return hilo
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FakeOpenAIServer
+
+    def log_message(self, format, *args):  # noqa: A002 - firma de BaseHTTPRequestHandler
+        pass
+
+    def do_POST(self):
+        longitud = int(self.headers.get("Content-Length") or 0)
+        cuerpo = json.loads(self.rfile.read(longitud) or b"{}")
+
+        if self.path == "/_control":
+            self.server.configurar(cuerpo)
+            self._responder(200, {"ok": True})
+            return
+
+        if not self.path.endswith("/chat/completions"):
+            self._responder(404, {"error": {"message": "ruta no soportada"}})
+            return
+
+        modelo = cuerpo.get("model", "")
+        latencia, error, json_invalido, goteo = self.server._siguiente_paso(modelo)
+        time.sleep(latencia)
+
+        if error:
+            self._responder(error, {"error": {"message": f"error inyectado {error}"}})
+            return
+
+        contenido = "{no es json" if json_invalido else json.dumps({"modelo": modelo, "ok": True})
+        self._responder(
+            200,
+            {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": modelo,
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": contenido},
+                    },
+                ],
+            },
+            goteo=goteo,
+        )
+
+    def _responder(self, status: int, datos: Dict[str, Any], goteo: float = 0.0) -> None:
+        cuerpo = json.dumps(datos).encode()
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            if not goteo:
+                self.wfile.write(cuerpo)
+                return
+            pausa = goteo / len(cuerpo)
+            for indice in range(len(cuerpo)):
+                self.wfile.write(cuerpo[indice:indice + 1])
+                self.wfile.flush()
+                time.sleep(pausa)
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente abandonó la solicitud (timeout o cobertura ganadora).
+            pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    servidor = FakeOpenAIServer((args.host, args.port))
+    print(f"Fake OpenAI escuchando en {servidor.url}")
+    servidor.serve_forever()
@@ -0,0 +1,258 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import subprocess
+import sys
+import time
+
+from ia_backend.utils.fake_openai_server import FakeOpenAIServer
+
+servidor = FakeOpenAIServer(("127.0.0.1", 0))
+servidor.iniciar_en_segundo_plano()
+os.environ["OPENAI_BASE_URL"] = servidor.url
+os.environ.setdefault("OPENAI_API_KEY", "fake")
+
+from ia_backend.services.openai_service import (  # noqa: E402
+    ConfiguracionOpenAI,
+    OpenAIConfigError,
+    OpenAIServiceError,
+    _latencias,
+    _registrar_latencia,
+    _retardo_cobertura,
+    limpiar_latencias,
+    solicitar_json,
+)
+
+BASE = ConfiguracionOpenAI(
+    modelo="gpt-4o",
+    modelo_respaldo="gpt-4o-mini",
+    timeout_segundos=1.0,
+    plazo_total_segundos=5.0,
+    reintentos=1,
+    backoff_segundos=0.05,
+    cobertura_segundos=None,
+)
+
+
+def _config(**cambios):
+    return ConfiguracionOpenAI(**{**BASE.__dict__, **cambios})
+
+
+def _ejecutar(escenario, config):
+    servidor.configurar(escenario)
+    limpiar_latencias()
+    inicio = time.monotonic()
+    try:
+        respuesta = solicitar_json("hola", config)
+    except OpenAIServiceError as exc:
+        respuesta = exc
+    return respuesta, time.monotonic() - inicio, list(servidor.solicitudes)
+
+
+# Prueba: respuesta normal del modelo principal
+resp, duracion, llamadas = _ejecutar({}, BASE)
+assert resp.modelo == "gpt-4o" and resp.contenido["ok"], resp
+print("Modelo principal:", resp.modelo, f"{duracion:.2f}s", llamadas)
+
+# Prueba: 500 transitorio se reintenta con el mismo modelo
+resp, duracion, llamadas = _ejecutar({"gpt-4o": {"errores": [500]}}, BASE)
+assert resp.modelo == "gpt-4o" and llamadas == ["gpt-4o", "gpt-4o"], llamadas
+print("Reintento tras 500:", resp.modelo, f"{duracion:.2f}s", llamadas)
+
+# Prueba: 429 (rate limit) se reintenta con el mismo modelo
+resp, duracion, llamadas = _ejecutar({"gpt-4o": {"errores": [429]}}, BASE)
+assert resp.modelo == "gpt-4o" and llamadas == ["gpt-4o", "gpt-4o"], llamadas
+print("Reintento tras 429:", resp.modelo, f"{duracion:.2f}s", llamadas)
+
+# Prueba: modelo principal caído, responde el de respaldo
+resp, duracion, llamadas = _ejecutar({"gpt-4o": {"errores": [503, 503]}}, BASE)
+assert resp.modelo == "gpt-4o-mini", resp
+print("Respaldo tras errores:", resp.modelo, f"{duracion:.2f}s", llamadas)
+
+# Prueba: error 4xx no se reintenta con el mismo modelo
+resp, duracion, llamadas = _ejecutar({"gpt-4o": {"errores": [404]}}, BASE)
+assert resp.modelo == "gpt-4o-mini" and llamadas == ["gpt-4o", "gpt-4o-mini"], llamadas
+print("Respaldo tras 404:", resp.modelo, f"{duracion:.2f}s", llamadas)
+
+# Prueba: modelo principal lento supera el timeout por intento
+resp, duracion, llamadas = _ejecutar({"gpt-4o": {"latencias": [3.0]}}, BASE)
+assert resp.modelo == "gpt-4o-mini" and duracion < 3.0, (resp, duracion)
+print("Respaldo tras timeout:", resp.modelo, f"{duracion:.2f}s", llamadas)
+
+# Prueba: una respuesta que gotea no supera el timeout por intento
+resp, duracion, llamadas = _ejecutar(
+    {"gpt-4o": {"goteo": 2.0}},
+    _config(timeout_segundos=0.5, plazo_total_segundos=1.5, reintentos=0),
+)
+assert resp.modelo == "gpt-4o-mini" and duracion < 1.0, (resp, duracion)
+print("Respaldo tras goteo:", resp.modelo, f"{duracion:.2f}s", llamadas)
+
+# Prueba: JSON inválido cuenta como fallo
+resp, duracion, llamadas = _ejecutar({"gpt-4o": {"json_invalido": True}}, BASE)
+assert resp.modelo == "gpt-4o-mini", resp
+print("Respaldo tras JSON inválido:", resp.modelo, f"{duracion:.2f}s", llamadas)
+
+# Prueba: solicitud de cobertura gana a la primera, que es lenta
+resp, duracion, llamadas = _ejecutar(
+    {"gpt-4o": {"latencias": [0.9, 0.05]}},
+    _config(cobertura_segundos=0.2),
+)
+assert resp.modelo == "gpt-4o" and duracion < 0.6 and len(llamadas) == 2, (resp, duracion)
+print("Cobertura:", resp.modelo, f"{duracion:.2f}s", llamadas)
+
+# Prueba: con carga, la cobertura no encola intentos ni deja solicitudes tardías
+servidor.configurar({"gpt-4o": {"latencias": [0.8]}})
+limpiar_latencias()
+bajo_carga = _config(cobertura_segundos=0.2, reintentos=0, modelo_respaldo=None)
+
+
+def _solicitar_bajo_carga(_):
+    try:
+        return solicitar_json("hola", bajo_carga).modelo == "gpt-4o"
+    except OpenAIServiceError:
+        return False
+
+
+with ThreadPoolExecutor(max_workers=16) as concurrentes:
+    exitos = sum(concurrentes.map(_solicitar_bajo_carga, range(16)))
+recibidas = len(servidor.solicitudes)
+time.sleep(1.5)
+assert exitos == 16, exitos
+assert len(servidor.solicitudes) == recibidas, (recibidas, len(servidor.solicitudes))
+print("Cobertura con carga:", exitos, "/ 16,", recibidas, "solicitudes")
+
+# Prueba: el principal lento no agota el plazo; el respaldo responde a tiempo
+resp, duracion, llamadas = _ejecutar(
+    {"gpt-4o": {"latencias": [3.0]}},
+    _config(plazo_total_segundos=1.5),
+)
+assert resp.modelo == "gpt-4o-mini" and duracion < 1.5, (resp, duracion)
+assert llamadas == ["gpt-4o", "gpt-4o-mini"], llamadas
+print("Respaldo con plazo ajustado:", resp.modelo, f"{duracion:.2f}s", llamadas)
+
+# Prueba: todo falla dentro del plazo total
+resp, duracion, llamadas = _ejecutar(
+    {"gpt-4o": {"latencias": [3.0]}, "gpt-4o-mini": {"latencias": [3.0]}},
+    _config(plazo_total_segundos=1.5),
+)
+assert isinstance(resp, OpenAIServiceError) and duracion < 2.0, (resp, duracion)
+assert "gpt-4o-mini" in llamadas, llamadas
+print("Plazo total agotado:", f"{duracion:.2f}s", resp)
+
+# Prueba: los timeouts cuentan para el p95 de cobertura y cada modelo tiene sus muestras
+servidor.configurar({"gpt-4o": {"latencias": [0.3]}})
+limpiar_latencias()
+solo_principal = _config(timeout_segundos=0.1, reintentos=0, modelo_respaldo=None)
+for _ in range(20):
+    try:
+        solicitar_json("hola", solo_principal)
+    except OpenAIServiceError:
+        pass
+assert _retardo_cobertura("gpt-4o", "json", 0.05) == 0.1, _retardo_cobertura("gpt-4o", "json", 0.05)
+assert _retardo_cobertura("gpt-4o-mini", "json", 0.05) == 0.05
+assert _retardo_cobertura("gpt-4o", "texto", 0.05) == 0.05
+print("p95 con timeouts:", _retardo_cobertura("gpt-4o", "json", 0.05))
+
+# Prueba: un timeout recortado por el plazo total se registra con el timeout configurado
+recortado = _config(
+    timeout_segundos=1.0,
+    plazo_total_segundos=0.3,
+    reintentos=0,
+    modelo_respaldo=None,
+)
+resp, duracion, llamadas = _ejecutar({"gpt-4o": {"latencias": [0.5]}}, recortado)
+assert isinstance(resp, OpenAIServiceError) and duracion < 0.5, (resp, duracion)
+assert list(_latencias[("gpt-4o", "json")]) == [1.0], _latencias
+print("Timeout recortado registrado como:", _latencias[("gpt-4o", "json")][0])
+
+# Prueba: con el p95 en el timeout, la cobertura se adelanta en vez de desactivarse
+limpiar_latencias()
+for _ in range(20):
+    _registrar_latencia("gpt-4o", "json", 1.0)
+servidor.configurar({"gpt-4o": {"latencias": [0.9, 0.05]}})
+resp = solicitar_json("hola", _config(cobertura_segundos=0.2, reintentos=0))
+llamadas = list(servidor.solicitudes)
+assert resp.modelo == "gpt-4o" and llamadas == ["gpt-4o", "gpt-4o"], llamadas
+print("Cobertura con p95 en el timeout:", llamadas)
+
+# Prueba: valores OPENAI_* fuera de rango son un error de configuración
+for variable, valor in [
+    ("OPENAI_REINTENTOS", "-1"),
+    ("OPENAI_REINTENTOS", "1.5"),
+    ("OPENAI_TIMEOUT_SEGUNDOS", "0"),
+    ("OPENAI_PLAZO_TOTAL_SEGUNDOS", "-5"),
+    ("OPENAI_BACKOFF_SEGUNDOS", "-0.1"),
+    ("OPENAI_TIMEOUT_SEGUNDOS", "abc"),
+]:
+    anterior = os.environ.get(variable)
+    os.environ[variable] = valor
+    try:
+        ConfiguracionOpenAI.desde_entorno()
+        raise AssertionError(f"{variable}={valor} debió rechazarse")
+    except OpenAIConfigError as exc:
+        assert variable in str(exc), exc
+    finally:
+        if anterior is None:
+            os.environ.pop(variable)
+        else:
+            os.environ[variable] = anterior
+print("Configuración inválida rechazada")
+
+# Las pruebas siguientes importan la API: requieren SUPABASE_URL y SUPABASE_SERVICE_KEY.
+# La configuración OPENAI_* se lee al importar la API, así que va antes del import.
+os.environ.update(OPENAI_REINTENTOS="0", OPENAI_BACKOFF_SEGUNDOS="0", OPENAI_TIMEOUT_SEGUNDOS="1")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from ia_backend.api.main import app  # noqa: E402
+from ia_backend.services.reportes_service import (  # noqa: E402
+    construir_reporte_sin_modelo,
+    obtener_resumen_para_prompt,
+)
+
+# Prueba: reporte determinista a partir del resumen para el prompt
+resumen = obtener_resumen_para_prompt(
+    {
+        "periodo": {"inicio": None, "fin": None},
+        "ingresos": {"total": 100.0, "por_categoria": [{"valor": "salario", "total": 100.0}]},
+        "gastos": {
+            "total": 120.0,
+            "por_categoria": [{"valor": "comida", "total": 80.0}],
+            "por_tipo_gasto": [],
+        },
+        "balance": {"neto": -20.0, "ratio_gastos_sobre_ingresos": 1.2},
+    },
+)
+reporte = construir_reporte_sin_modelo("comparativo", resumen)
+assert "balance -20.00" in reporte["resumen"], reporte
+assert len(reporte["alertas"]) == 3 and reporte["recomendaciones"], reporte
+assert construir_reporte_sin_modelo("comparativo", None)["alertas"] == []
+print("Reporte determinista:", reporte["resumen"])
+
+cliente = TestClient(app)
+cuerpo = {"tipo": "comparativo", "parametros": {}}
+
+# Prueba: /reportes usa el modelo cuando responde
+servidor.configurar({})
+resp = cliente.post("/reportes", json=cuerpo)
+assert resp.status_code == 200 and resp.json()["origen_reporte"] == "gpt-4o", resp.text
+print("/reportes con modelo:", resp.json()["origen_reporte"])
+
+# Prueba: /reportes cae al reporte determinista si ningún modelo responde
+servidor.configurar({"gpt-4o": {"errores": [503]}, "gpt-4o-mini": {"errores": [503]}})
+resp = cliente.post("/reportes", json=cuerpo)
+assert resp.status_code == 200 and resp.json()["origen_reporte"] == "determinista", resp.text
+assert "recomendaciones" in resp.json()["reporte_modelo"], resp.text
+print("/reportes sin modelo:", resp.json()["origen_reporte"])
+
+# Prueba: una variable OPENAI_* mal formada detiene el arranque de la API
+arranque = subprocess.run(
+    [sys.executable, "-c", "import ia_backend.api.main"],
+    env={**os.environ, "OPENAI_TIMEOUT_SEGUNDOS": "abc"},
+    capture_output=True,
+    text=True,
+)
+assert arranque.returncode != 0, arranque.stdout
+assert "OpenAIConfigError" in arranque.stderr and "OPENAI_TIMEOUT_SEGUNDOS" in arranque.stderr
+print("Arranque con configuración inválida:", arranque.stderr.strip().splitlines()[-1])
+
+servidor.shutdown()
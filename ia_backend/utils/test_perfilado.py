@@ -0,0 +1,92 @@
+import os
+import pstats
+import tempfile
+
+from ia_backend.utils.fake_openai_server import FakeOpenAIServer
+
+servidor = FakeOpenAIServer(("127.0.0.1", 0))
+servidor.iniciar_en_segundo_plano()
+
+# La configuración de perfilado se lee al importar la API, así que va antes del import.
+# Importar la API requiere además SUPABASE_URL y SUPABASE_SERVICE_KEY.
+os.environ.update(
+    OPENAI_BASE_URL=servidor.url,
+    OPENAI_API_KEY=os.getenv("OPENAI_API_KEY") or "fake",
+    OPENAI_REINTENTOS="0",
+    PROFILING_ADMIN_TOKEN="token-pruebas",
+    PROFILING_UMBRAL_MS="300",
+    PROFILING_TASA_MUESTREO="0",
+    PROFILING_MAX_CAPTURAS="3",
+    PROFILING_MOTOR="cprofile",
+)
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from ia_backend.api.main import app  # noqa: E402
+
+cliente = TestClient(app)
+ADMIN = {"X-Admin-Token": "token-pruebas"}
+CUERPO = {"resumen": {"ingresos": 100}, "categorias": []}
+
+
+def _ids_capturas():
+    return [perfil["id"] for perfil in cliente.get("/perfiles", headers=ADMIN).json()["perfiles"]]
+
+
+# Prueba: pedir un perfil sin token (o con uno incorrecto) devuelve 403
+resp = cliente.post("/analisis?profile=1", json=CUERPO)
+assert resp.status_code == 403, resp.text
+resp = cliente.post("/analisis", json=CUERPO, headers={"X-Profile": "1", "X-Admin-Token": "otro"})
+assert resp.status_code == 403, resp.text
+assert cliente.get("/perfiles").status_code == 403
+print("Sin token:", resp.status_code)
+
+# Prueba: con token válido se devuelve X-Perfil-Id y la captura queda listada
+resp = cliente.post("/analisis?profile=1", json=CUERPO, headers=ADMIN)
+assert resp.status_code == 200, resp.text
+perfil_id = resp.headers["X-Perfil-Id"]
+detalle = cliente.get(f"/perfiles/{perfil_id}", headers=ADMIN).json()
+assert detalle["motivo"] == "solicitado" and detalle["motor"] == "cprofile", detalle
+assert [tramo["nombre"] for tramo in detalle["tramos"]] == ["openai.solicitud"], detalle
+print("Con token:", perfil_id)
+
+# Prueba: el .prof descargado se carga con pstats
+resp = cliente.get(f"/perfiles/{perfil_id}/descarga", headers=ADMIN)
+assert resp.status_code == 200 and f"perfil-{perfil_id}.prof" in resp.headers["content-disposition"]
+with tempfile.NamedTemporaryFile(suffix=".prof", delete=False) as archivo:
+    archivo.write(resp.content)
+try:
+    estadisticas = pstats.Stats(archivo.name)
+    assert estadisticas.total_calls > 0
+finally:
+    os.unlink(archivo.name)
+print("Descarga .prof:", estadisticas.total_calls, "llamadas")
+
+# Prueba: solo se guardan las solicitudes que superan el umbral
+antes = _ids_capturas()
+cliente.post("/analisis", json=CUERPO)
+assert _ids_capturas() == antes, "una solicitud rápida no debe guardarse"
+servidor.configurar({"gpt-4o": {"latencias": [0.4]}})
+cliente.post("/analisis", json=CUERPO)
+lenta = cliente.get("/perfiles", headers=ADMIN).json()["perfiles"][0]
+assert lenta["motivo"] == "lento" and lenta["duracion_ms"] >= 300 and not lenta["descargable"], lenta
+servidor.configurar({})
+print("Umbral:", lenta["motivo"], lenta["duracion_ms"], "ms")
+
+# Prueba: consultar /perfiles no genera capturas propias
+ids = _ids_capturas()
+for _ in range(5):
+    cliente.get("/perfiles", headers=ADMIN)
+assert _ids_capturas() == ids, "las consultas a /perfiles no deben capturarse"
+print("/perfiles excluido:", len(ids), "capturas")
+
+# Prueba: al superar PROFILING_MAX_CAPTURAS se descartan las más antiguas
+nuevos = [
+    cliente.post("/analisis?profile=1", json=CUERPO, headers=ADMIN).headers["X-Perfil-Id"]
+    for _ in range(3)
+]
+assert _ids_capturas() == list(reversed(nuevos)), _ids_capturas()
+assert cliente.get(f"/perfiles/{perfil_id}", headers=ADMIN).status_code == 404
+print("Buffer circular:", len(_ids_capturas()), "capturas")
+
+servidor.shutdown()